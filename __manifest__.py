@@ -5,7 +5,7 @@
     'name': 'Rent Debt Collection',
     'description': """
         Rental tenant debt collection actions""",
-    'version': '13.0.1.3.0',
+    'version': '13.0.1.4.0',
     'license': 'AGPL-3',
     'author': 'Babur Ltda.',
     'website': 'babur.com.br',
@@ -21,6 +21,7 @@
     'data': [
         'views/fleet_settings.xml',
         'views/account_move.xml',
+        'views/fleet_vehicle.xml',
         "data/sms_data.xml",
         "data/whatsapp_data.xml",
         "data/email_data.xml",
@@ -28,5 +29,8 @@
         "security/ir.model.access.csv",
         "security/sms_security.xml",
     ],
+    'external_dependencies': {
+        'python': ['aiohttp'],
+    },
     'application': True,
 }
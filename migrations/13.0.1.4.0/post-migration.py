@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+from odoo import api, SUPERUSER_ID
+
+# Templates de e-mail (noupdate) que passam a listar as faturas consolidadas
+EMAIL_TEMPLATES = [
+    'rent_debt_collection.email_template_aviso_atraso_bloqueio_24h',
+    'rent_debt_collection.email_template_aviso_vencimento_reincidente_bloqueio_24h',
+    'rent_debt_collection.email_template_aviso_bloqueio_efetuado',
+]
+
+
+def migrate(cr, version):
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    for xml_id in EMAIL_TEMPLATES:
+        template = env.ref(xml_id, raise_if_not_found=False)
+        if template and template.body_html and '${object.name}' in template.body_html:
+            template.body_html = template.body_html.replace(
+                '<strong>${object.name}</strong>', '<strong>${object.debt_invoice_summary}</strong>'
+            )
+
+    # O estado da última execução do cron de bloqueio passou para rent.debt.block.run
+    env['ir.config_parameter'].search([('key', '=', 'fleet.block_last_run_state')]).unlink()
@@ -1,3 +1,7 @@
 from . import account_move
 from . import res_config_settings
-from . import mail_broker_channel
\ No newline at end of file
+from . import mail_broker_channel
+from . import mail_template
+from . import fleet_vehicle
+from . import rent_debt_tracker_sync
+from . import rent_debt_block_run
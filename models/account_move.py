@@ -1,22 +1,62 @@
 # -*- coding: utf-8 -*-
 import logging
 import datetime
+import math
 import pytz
+import threading
 import uuid
+from contextlib import contextmanager
 from datetime import timedelta
 from odoo import models, fields, api, _
+from odoo.tools.misc import formatLang
 from workalendar.america.brazil import Brazil
+from .mail_template import COMPILED_RENDER_KEY
+from ..tools.read_replica import ReadReplica
+from ..tools.traccar_client import (
+    TraccarClient, TraccarError, run_sync, ENGINE_STOP, ENGINE_RESUME, STATE_BLOCKED, STATE_UNBLOCKED,
+)
 
 _logger = logging.getLogger(__name__)
 
+# Chave de contexto com as faturas listadas em uma notificação consolidada
+INVOICE_GROUP_KEY = 'rent_debt_invoice_group'
+# Réplicas de leitura abertas pela execução corrente do cron, por banco de dados.
+# Ficam fora do contexto para não serem copiadas em create/envios de mensagens.
+_read_replicas = threading.local()
+
+# Histórico de faturas para a análise de reincidência, com a data do último pagamento
+# conciliado (mesma informação de _get_reconciled_info_JSON_values), em uma única consulta.
+# As faturas vêm da mesma busca do ORM (domínio e regras de registro), em subconsulta.
+RECIDIVISM_HISTORY_QUERY = """
+    SELECT m.invoice_payment_state, m.invoice_date_due, max(counterpart.date)
+    FROM account_move m
+    LEFT JOIN account_move_line line
+        ON line.move_id = m.id AND line.account_internal_type IN ('receivable', 'payable')
+    LEFT JOIN account_partial_reconcile apr
+        ON apr.debit_move_id = line.id OR apr.credit_move_id = line.id
+    LEFT JOIN account_move_line counterpart
+        ON counterpart.id = CASE WHEN apr.debit_move_id = line.id THEN apr.credit_move_id ELSE apr.debit_move_id END
+    WHERE m.id IN (SELECT "account_move".id FROM {from_clause} WHERE {where_clause})
+    GROUP BY m.id, m.invoice_payment_state, m.invoice_date_due
+"""
+
 class AccountMove(models.Model):
     _inherit = 'account.move'
 
-    payment_promise = fields.Datetime(string='Payment Promise', help="Date and time of payment promise")
+    payment_promise = fields.Datetime(string='Payment Promise', index=True, help="Date and time of payment promise")
 
     # token used for portal access to the invoice without requiring a login
     access_token = fields.Char('Access Token', copy=False, readonly=True)
 
+    def init(self):
+        super().init()
+        # Índice parcial para o watermark do cron de bloqueio: apenas faturas de cliente em aberto
+        self._cr.execute("""
+            CREATE INDEX IF NOT EXISTS account_move_open_invoice_write_date_index
+            ON account_move (write_date)
+            WHERE type = 'out_invoice' AND state = 'posted' AND invoice_payment_state = 'not_paid'
+        """)
+
     @api.model
     def create(self, vals):
         # ensure each new invoice has a portal token right away
@@ -47,6 +87,24 @@ class AccountMove(models.Model):
     wa_invoice_name = fields.Char(compute='_compute_wa_safe_fields', store=True)
     wa_url_suffix = fields.Char(compute='_compute_wa_url_suffix', store=True)
 
+    # Faturas listadas na notificação (consolidada ou não), com o total devido quando agrupadas
+    debt_invoice_summary = fields.Char(compute='_compute_debt_invoice_summary')
+
+    @api.depends('name', 'amount_residual')
+    @api.depends_context(INVOICE_GROUP_KEY)
+    def _compute_debt_invoice_summary(self):
+        group_ids = self.env.context.get(INVOICE_GROUP_KEY) or ()
+        for rec in self:
+            if rec.id in group_ids and len(group_ids) > 1:
+                group = self.browse(group_ids)
+                total = sum(group.mapped('amount_residual'))
+                rec.debt_invoice_summary = "%s (total %s)" % (
+                    ", ".join(move.name or 'Fatura' for move in group),
+                    formatLang(self.env, total, currency_obj=rec.currency_id),
+                )
+            else:
+                rec.debt_invoice_summary = rec.name or 'Fatura'
+
     @api.depends('partner_id.name', 'name')
     def _compute_wa_safe_fields(self):
         for rec in self:
@@ -102,6 +160,64 @@ class AccountMove(models.Model):
             # WhatsApp API may reject empty parameters, so provide a placeholder if empty
             rec.pix_copy_code = str(code or 'PIX indisponível')
 
+    def _prepare_notification_fields(self):
+        """
+        Garante que os campos usados nas variáveis dos templates estejam preenchidos.
+        Chamado uma vez por notificação: os valores resolvidos ficam no cache do ORM e são
+        reaproveitados pelo WhatsApp, pelo fallback de SMS e pela redundância de e-mail.
+        """
+        self.ensure_one()
+        # Ensure computed fields are ready for the template variables
+        # This fixes issues where fields might be empty for old records
+        if not self.wa_partner_name or not self.wa_invoice_name:
+            self._compute_wa_safe_fields()
+        if not self.payment_url:
+            self._compute_payment_url()
+        if not self.pix_copy_code:
+            self._compute_pix_copy_code()
+        if not self.wa_url_suffix:
+            self._compute_wa_url_suffix()
+
+    def _queue_notification(self, queue, template_xml_id, sms_fallback_xml_id=False, email_template_xml_id=False):
+        """
+        Enfileira a notificação das faturas do recordset em ``queue``, um dicionário local
+        da execução que agrupa as faturas por parceiro e template. Fica fora do contexto,
+        que é copiado para whatsapp.message e para os envios de e-mail.
+        """
+        for move in self:
+            key = (move.partner_id.id, template_xml_id, sms_fallback_xml_id, email_template_xml_id)
+            if move.id not in queue.setdefault(key, []):
+                queue[key].append(move.id)
+
+    @api.model
+    def _flush_notification_queue(self, queue):
+        """Envia uma notificação consolidada por parceiro e template enfileirados em ``queue``."""
+        while queue:
+            (partner_id, template_xml_id, sms_fallback_xml_id, email_template_xml_id), move_ids = queue.popitem()
+            moves = self.browse(move_ids).exists()
+            if not moves:
+                continue
+            try:
+                moves._send_consolidated_notification(template_xml_id, sms_fallback_xml_id, email_template_xml_id)
+            except Exception as e:
+                _logger.exception("Erro ao enviar notificação consolidada para parceiro %s: %s" % (partner_id, e))
+
+    def _send_consolidated_notification(self, template_xml_id, sms_fallback_xml_id=False, email_template_xml_id=False):
+        """
+        Envia uma única notificação (WhatsApp / SMS / Email) para as faturas do recordset,
+        todas do mesmo parceiro. A fatura mais antiga é o objeto do template, de modo que
+        o link de pagamento aponta para ela; debt_invoice_summary lista as faturas e o total.
+        """
+        moves = self.sorted(lambda m: (m.invoice_date_due or datetime.date.max, m.id))
+        oldest = moves[0].with_context(**{INVOICE_GROUP_KEY: tuple(moves.ids)})
+        if len(moves) > 1:
+            _logger.info("Notificação consolidada para %s: faturas %s" % (oldest.partner_id.name, moves.ids))
+
+        oldest._prepare_notification_fields()
+        oldest._send_whatsapp_notification(template_xml_id, sms_fallback_xml_id=sms_fallback_xml_id)
+        if email_template_xml_id:
+            oldest._send_email_notification(email_template_xml_id)
+
     def _send_email_notification(self, template_xml_id):
         """
         Envia redundância de notificação via e-mail.
@@ -110,7 +226,7 @@ class AccountMove(models.Model):
         try:
             template = self.env.ref(template_xml_id, raise_if_not_found=False)
             if template and self.partner_id.email:
-                template.send_mail(self.id, force_send=True)
+                template.with_context(**{COMPILED_RENDER_KEY: True}).send_mail(self.id, force_send=True)
                 _logger.info("E-mail de redundância enviado para %s (Template: %s)" % (self.partner_id.name, template_xml_id))
             elif not self.partner_id.email:
                 _logger.warning("Parceiro %s não possui e-mail cadastrado para redundância." % self.partner_id.name)
@@ -127,16 +243,7 @@ class AccountMove(models.Model):
         try:
             template = self.env.ref(template_xml_id, raise_if_not_found=False)
             if template:
-                # Ensure computed fields are ready for the template variables
-                # This fixes issues where fields might be empty for old records
-                if not self.wa_partner_name or not self.wa_invoice_name:
-                    self._compute_wa_safe_fields()
-                if not self.payment_url:
-                    self._compute_payment_url()
-                if not self.pix_copy_code:
-                    self._compute_pix_copy_code()
-                if not self.wa_url_suffix:
-                    self._compute_wa_url_suffix()
+                self._prepare_notification_fields()
 
                 # Busca telefone móvel
                 phone = self.partner_id.mobile or self.partner_id.phone
@@ -190,7 +297,7 @@ class AccountMove(models.Model):
             try:
                 sms_template = self.env.ref(sms_fallback_xml_id, raise_if_not_found=False)
                 if sms_template:
-                    sms_template.send_sms([self.id], force_send=True)
+                    sms_template.with_context(**{COMPILED_RENDER_KEY: True}).send_sms([self.id], force_send=True)
                     return True
             except Exception as e:
                 _logger.exception("Erro no fallback de SMS: %s" % e)
@@ -205,23 +312,26 @@ class AccountMove(models.Model):
 
         # Busca todas as faturas em aberto (vencidas ou vencendo hoje)
         # Otimização: filtrar apenas as que podem gerar aviso (vencimento <= hoje)
-        moves = self.search([
-            ('type', '=', 'out_invoice'),
-            ('state', '=', 'posted'),
-            ('invoice_payment_state', '=', 'not_paid'),
-            ('invoice_date_due', '<=', today)
-        ])
-
+        # Busca candidata na réplica de leitura, quando configurada
+        with self._read_replica_env() as reader:
+            moves = reader._search_read_only([
+                ('type', '=', 'out_invoice'),
+                ('state', '=', 'posted'),
+                ('invoice_payment_state', '=', 'not_paid'),
+                ('invoice_date_due', '<=', today)
+            ] + self._get_no_active_promise_domain())
+            moves._process_whatsapp_reminder(today)
+
+    def _process_whatsapp_reminder(self, today):
+        """Avalia as faturas candidatas e enfileira os avisos de bloqueio iminente."""
+        moves = self
+        queue = {}
         cal = Brazil()
         ICP = self.env['ir.config_parameter'].sudo()
         default_tolerance = int(ICP.get_param('fleet.block_tolerance_days', default=2))
 
         for move in moves:
             try:
-                # Verifica promessa de pagamento
-                if move._active_payment_promise():
-                    continue
-
                 is_recidivist = move._is_recidivist()
                 tolerance_days = 0 if is_recidivist else default_tolerance
 
@@ -266,41 +376,140 @@ class AccountMove(models.Model):
                         wa_template_xml_id = 'rent_debt_collection.wa_template_aviso_atraso_bloqueio_24h'
                         email_template_xml_id = 'rent_debt_collection.email_template_aviso_atraso_bloqueio_24h'
 
-                    move._send_whatsapp_notification(
+                    move._queue_notification(
+                        queue,
                         wa_template_xml_id,
-                        sms_fallback_xml_id=sms_fallback
+                        sms_fallback_xml_id=sms_fallback,
+                        email_template_xml_id=email_template_xml_id
                     )
-                    move._send_email_notification(email_template_xml_id)
 
             except Exception as e:
                 _logger.exception("Erro ao processar lembrete WhatsApp para fatura %s: %s" % (move.id, e))
 
+        # Uma notificação por motorista, listando todas as faturas que dispararam o aviso
+        moves._flush_notification_queue(queue)
+
     def _active_payment_promise(self):
         """Retorna True se houver uma promessa de pagamento válida no futuro."""
         return self.payment_promise and self.payment_promise > fields.Datetime.now()
 
-    def _create_payment_promise(self):
-        self.write({
-            'payment_promise': fields.Datetime.now() + timedelta(hours=24)
-        })
+    @api.model
+    def _get_no_active_promise_domain(self):
+        """Domínio que exclui, no SQL, faturas com promessa de pagamento ativa."""
+        return ['|', ('payment_promise', '=', False), ('payment_promise', '<=', fields.Datetime.now())]
 
-    def _is_recidivist(self):
+    def _create_payment_promise(self, hours=None):
         """
-        Verifica se o parceiro (motorista) é reincidente em atrasos nos últimos N dias.
-        Considera feriados e finais de semana: Se o vencimento cair em dia não útil,
-        o pagamento no próximo dia útil é considerado pontual.
+        Concede promessa de pagamento às faturas do recordset em uma única escrita.
+        Apenas faturas de cliente publicadas e em aberto são consideradas.
+        A duração padrão vem de fleet.payment_promise_hours (24h).
         """
+        moves = self.filtered(lambda m: (
+            m.type == 'out_invoice' and m.state == 'posted' and m.invoice_payment_state == 'not_paid'
+        ))
+        if not moves:
+            return moves
+        if hours is None:
+            ICP = self.env['ir.config_parameter'].sudo()
+            hours = float(ICP.get_param('fleet.payment_promise_hours', default=24.0))
+
+        promise_date = fields.Datetime.now() + timedelta(hours=hours)
+        moves.write({
+            'payment_promise': promise_date
+        })
 
-        # Instancia o calendário apenas uma vez para performance
-        cal = Brazil()
+        # Trilha de auditoria na fatura, com a data no fuso horário do usuário
+        local_promise_date = fields.Datetime.context_timestamp(self, promise_date)
+        msg = _(
+            "Promessa de pagamento concedida por %s até %s."
+        ) % (self.env.user.name, local_promise_date.strftime('%d/%m/%Y %H:%M'))
+        for move in moves:
+            move.message_post(body=msg)
 
-        # Get configured recidivism window or use default 28 days
+        _logger.info("Promessa de pagamento concedida para faturas %s até %s (UTC)", moves.ids, promise_date)
+        return moves
+
+    @api.model
+    def _create_partner_payment_promise(self, partner, hours=None):
+        """Concede promessa de pagamento a todas as faturas em aberto do parceiro."""
+        moves = self.search([
+            ('partner_id', 'child_of', partner.commercial_partner_id.id),
+            ('type', '=', 'out_invoice'),
+            ('state', '=', 'posted'),
+            ('invoice_payment_state', '=', 'not_paid'),
+        ])
+        return moves._create_payment_promise(hours=hours)
+
+    def action_grant_payment_promise(self):
+        """Ação de servidor: concede promessa de pagamento às faturas selecionadas."""
+        self._create_payment_promise()
+
+    @contextmanager
+    def _read_replica_env(self):
+        """
+        Abre a réplica de leitura para as buscas do cron durante o bloco.
+        Sem réplica configurada, inacessível ou atrasada demais, as leituras seguem no primário.
+        As escritas (message_post, promessas, comandos) sempre usam o cursor primário.
+        """
+        replicas = getattr(_read_replicas, 'by_db', None)
+        if replicas is None:
+            replicas = _read_replicas.by_db = {}
+        dbname = self.env.cr.dbname
         ICP = self.env['ir.config_parameter'].sudo()
-        recidivism_days = int(ICP.get_param('fleet.recidivism_window_days', default=28))
+        dsn = ICP.get_param('fleet.read_replica_dsn')
+        if not dsn or dbname in replicas:
+            yield self
+            return
 
-        # Janela de análise: N dias antes do vencimento desta fatura
-        start_check_date = self.invoice_date_due - timedelta(days=recidivism_days)
+        replica = ReadReplica(dsn, max_lag=float(ICP.get_param('fleet.read_replica_max_lag', default=30)))
+        if not replica.open():
+            yield self
+            return
+
+        replicas[dbname] = replica
+        try:
+            yield self
+        finally:
+            del replicas[dbname]
+            replica.close()
+
+    def _fetch_from_replica(self, query, params):
+        """
+        Executa a consulta na réplica aberta por _read_replica_env(). Retorna None se não há
+        réplica ou se ela ficou atrasada/inacessível, e o chamador deve ler do primário.
+        """
+        replica = getattr(_read_replicas, 'by_db', {}).get(self.env.cr.dbname)
+        if not replica or not replica.is_available():
+            return None
+        try:
+            return replica.fetchall(query, params)
+        except Exception as e:
+            _logger.warning("Read replica query failed, using primary: %s", e)
+            return None
 
+    @api.model
+    def _search_read_only(self, domain, order=None):
+        """
+        Equivalente a search() para as buscas somente leitura dos crons, executada
+        na réplica quando disponível. A SQL é gerada pelo ORM, como em _search().
+        """
+        query = self._where_calc(domain)
+        self._apply_ir_rules(query, 'read')
+        order_by = self._generate_order_by(order, query)
+        from_clause, where_clause, where_params = query.get_sql()
+        where_str = where_clause and (" WHERE %s" % where_clause) or ''
+        query_str = 'SELECT "%s".id FROM ' % self._table + from_clause + where_str + order_by
+        rows = self._fetch_from_replica(query_str, where_params)
+        if rows is None:
+            return self.search(domain, order=order)
+        return self.browse([row[0] for row in rows])
+
+    def _get_recidivism_history(self, start_check_date):
+        """
+        Gera (invoice_payment_state, invoice_date_due, data do último pagamento)
+        das faturas anteriores do parceiro na janela de reincidência.
+        """
+        self.ensure_one()
         domain = [
             ('id', '!=', self.id), # Não conta a si mesma
             ('partner_id', '=', self.partner_id.id),
@@ -310,15 +519,26 @@ class AccountMove(models.Model):
             ('invoice_date_due', '<', self.invoice_date_due), # Apenas histórico passado
         ]
 
+        query = self._where_calc(domain)
+        self._apply_ir_rules(query, 'read')
+        from_clause, where_clause, where_params = query.get_sql()
+        rows = self._fetch_from_replica(
+            RECIDIVISM_HISTORY_QUERY.format(from_clause=from_clause, where_clause=where_clause), where_params
+        )
+        if rows is not None:
+            for row in rows:
+                yield row
+            return
+
         # Otimização: Search apenas nos campos necessários
         previous_invoices = self.search(domain)
 
         for inv in previous_invoices:
-            # 1. Se não está paga e a data de vencimento (original) já passou, é atraso certo.
+            # Faturas em aberto não precisam da leitura de conciliações
             if inv.invoice_payment_state != 'paid':
-                return True
+                yield inv.invoice_payment_state, inv.invoice_date_due, None
+                continue
 
-            # 2. Se está paga, precisamos verificar QUANDO foi paga em relação ao dia útil
             reconciled_vals = inv._get_reconciled_info_JSON_values() or []
 
             payment_dates = []
@@ -327,10 +547,32 @@ class AccountMove(models.Model):
                 if p_date:
                     payment_dates.append(fields.Date.from_string(str(p_date)))
 
-            if payment_dates:
-                last_payment_date = max(payment_dates)
-                original_due_date = inv.invoice_date_due
+            yield inv.invoice_payment_state, inv.invoice_date_due, max(payment_dates) if payment_dates else None
+
+    def _is_recidivist(self):
+        """
+        Verifica se o parceiro (motorista) é reincidente em atrasos nos últimos N dias.
+        Considera feriados e finais de semana: Se o vencimento cair em dia não útil,
+        o pagamento no próximo dia útil é considerado pontual.
+        """
+
+        # Instancia o calendário apenas uma vez para performance
+        cal = Brazil()
+
+        # Get configured recidivism window or use default 28 days
+        ICP = self.env['ir.config_parameter'].sudo()
+        recidivism_days = int(ICP.get_param('fleet.recidivism_window_days', default=28))
 
+        # Janela de análise: N dias antes do vencimento desta fatura
+        start_check_date = self.invoice_date_due - timedelta(days=recidivism_days)
+
+        for payment_state, original_due_date, last_payment_date in self._get_recidivism_history(start_check_date):
+            # 1. Se não está paga e a data de vencimento (original) já passou, é atraso certo.
+            if payment_state != 'paid':
+                return True
+
+            # 2. Se está paga, precisamos verificar QUANDO foi paga em relação ao dia útil
+            if last_payment_date:
                 # Lógica de Dia Útil Bancário:
                 # Se o vencimento cai em dia não útil, posterga para o próximo dia útil.
                 if not cal.is_working_day(original_due_date):
@@ -360,10 +602,32 @@ class AccountMove(models.Model):
         end_hour = float(ICP.get_param('fleet.block_end_hour', default=18.0))
 
         # Verifica se está fora do horário permitido
-        if not (start_hour <= now_local.hour < end_hour):
+        now_hour = now_local.hour + now_local.minute / 60.0
+        if not (start_hour <= now_hour < end_hour):
             _logger.info(f"Skipping block batch: Outside working hours ({now_local.strftime('%H:%M')} in {tz_name})")
             return
 
+        # Pré-verificação: se nada mudou desde a última execução completa, não há o que reprocessar.
+        # Data local, limite de compensação, regras configuradas e validade do estado dos
+        # rastreadores também entram no estado, pois alteram o resultado sem escrever registros.
+        compensation_limit_hour = float(ICP.get_param('fleet.compensation_limit_hour', default=12.0))
+        watermark = self._get_change_watermark()
+        run_state = "|".join(str(value) for value in (
+            watermark,
+            now_local.date(),
+            now_hour >= compensation_limit_hour,
+            compensation_limit_hour,
+            start_hour,
+            end_hour,
+            ICP.get_param('fleet.block_tolerance_days', default=2),
+            ICP.get_param('fleet.recidivism_window_days', default=28),
+            self.env['fleet.vehicle']._is_engine_state_fresh(),
+        ))
+        BlockRun = self.env['rent.debt.block.run']
+        if not self.env.context.get('force_block_run') and BlockRun._get_last_state() == run_state:
+            _logger.info("Skipping block batch: No changes since last run (%s)", watermark)
+            return
+
         _logger.info("Starting batch vehicle block check...")
 
         # Data de corte: Vencidas até ontem (hoje não conta como atraso para bloqueio imediato no batch)
@@ -378,25 +642,211 @@ class AccountMove(models.Model):
             '|',
                 ('transaction_ids', '=', False),
                 ('transaction_ids.inter_status', 'in', ['VENCIDO', 'ATRASADO'])
+        ] + self._get_no_active_promise_domain()
+
+        # Leituras (candidatas e histórico de reincidência) na réplica, quando configurada;
+        # _evaluate_vehicle_block revalida cada fatura no primário antes de bloquear.
+        with self._read_replica_env() as reader:
+            moves = reader._search_read_only(invoice_filters)
+            _logger.info(f"Found {len(moves)} potentially overdue invoices.")
+
+            # 1. Avalia as faturas e reúne os veículos a bloquear em toda a execução.
+            # A primeira fatura de cada motorista reivindica os veículos dele.
+            had_errors = False
+            blocks = []
+            claimed = self.env['fleet.vehicle']
+            for move in moves:
+                try:
+                    evaluation = move._evaluate_vehicle_block()
+                    if not evaluation:
+                        continue
+                    vehicles = move._get_vehicles_to_block() - claimed
+                    if not vehicles:
+                        _logger.info(f"Move {move.id}: Nenhum veículo a bloquear para o parceiro {move.partner_id.name}.")
+                        continue
+                    claimed |= vehicles
+                    blocks.append((move, vehicles, evaluation))
+                except Exception as e:
+                    self.env.cr.rollback()
+                    had_errors = True
+                    _logger.exception(f"Error processing block for move {move.id}: {e}")
+
+            # 2. Um único lote de comandos, pelo mesmo cliente (e pool de conexões), para a execução
+            results = {}
+            if claimed:
+                _logger.info(f"Sending BLOCK command to vehicles {claimed.mapped('license_plate')}")
+                results = self._send_engine_commands(claimed, ENGINE_STOP)
+
+            # 3. Registra os bloqueios aceitos por fatura (uma por motorista) e avisa o motorista
+            # logo em seguida: se a execução for interrompida, quem já foi bloqueado já foi avisado.
+            for move, vehicles, (days_overdue, tolerance_days, is_recidivist) in blocks:
+                try:
+                    if move._record_vehicle_block(vehicles, results, days_overdue, tolerance_days, is_recidivist) is False:
+                        had_errors = True
+                    # Commit a cada registro para evitar long transaction locks e timeouts
+                    self.env.cr.commit()
+                except Exception as e:
+                    self.env.cr.rollback()
+                    had_errors = True
+                    _logger.exception(f"Error processing block for move {move.id}: {e}")
+                    continue
+
+                if any(results.get(vehicle.id) is True for vehicle in vehicles):
+                    try:
+                        move._send_block_notification()
+                        self.env.cr.commit()
+                    except Exception as e:
+                        self.env.cr.rollback()
+                        _logger.exception(f"Erro ao enviar aviso de bloqueio (Fatura {move.id}): {e}")
+
+        # Só avança o watermark se a execução foi completa, para que falhas sejam retentadas
+        if not had_errors:
+            BlockRun._set_last_state(run_state)
+            self.env.cr.commit()
+
+    @api.model
+    def _get_change_watermark(self):
+        """
+        Retorna a assinatura dos dados relevantes ao bloqueio: faturas de cliente em aberto
+        (quantidade e maior write_date), suas transações, veículos com rastreador e seus
+        rastreadores. Inclui a promessa de pagamento expirada mais recente, pois a expiração
+        não altera write_date. Movimentos de outras faturas não invalidam o watermark.
+        """
+        open_invoice_where = "m.type = 'out_invoice' AND m.state = 'posted' AND m.invoice_payment_state = 'not_paid'"
+        transaction_field = self._fields['transaction_ids']
+        subqueries = [
+            "SELECT max(m.write_date) FROM account_move m WHERE %s" % open_invoice_where,
+            """SELECT max(t.write_date) FROM payment_transaction t
+               JOIN %s rel ON rel.%s = t.id
+               JOIN account_move m ON m.id = rel.%s
+               WHERE %s""" % (transaction_field.relation, transaction_field.column2,
+                              transaction_field.column1, open_invoice_where),
+            "SELECT max(v.write_date) FROM fleet_vehicle v WHERE v.tracker_device IS NOT NULL",
+            "SELECT max(m.payment_promise) FROM account_move m WHERE m.payment_promise <= (now() at time zone 'UTC')",
+            "SELECT count(*) FROM account_move m WHERE %s" % open_invoice_where,
         ]
+        tracker_field = self.env['fleet.vehicle']._fields.get('tracker_device')
+        if tracker_field:
+            subqueries.append(
+                "SELECT max(t.write_date) FROM %s t JOIN fleet_vehicle v ON v.tracker_device = t.id"
+                % self.env[tracker_field.comodel_name]._table
+            )
 
-        moves = self.search(invoice_filters)
-        _logger.info(f"Found {len(moves)} potentially overdue invoices.")
+        self.env.cr.execute("SELECT %s" % ", ".join("(%s)" % query for query in subqueries))
+        return self.env.cr.fetchone()
 
-        for move in moves:
-            try:
-                move._block_vehicle_w_invoice_overdue()
-                # Commit a cada registro para evitar long transaction locks e timeouts
-                self.env.cr.commit()
-            except Exception as e:
-                self.env.cr.rollback()
-                _logger.exception(f"Error processing block for move {move.id}: {e}")
+    @api.model
+    def _schedule_block_cron(self):
+        """
+        Deriva a agenda do cron de bloqueio da janela configurada: a próxima execução é
+        posicionada no início da janela (ou agora, se dentro dela) e o número de chamadas
+        limitado ao que cabe até o fim da janela. Ao esgotar as chamadas o cron fica inativo
+        até ser reagendado pelo cron diário ou ao salvar as configurações.
+        Um cron desativado manualmente (com chamadas restantes) não é reativado.
+        """
+        cron = self.env.ref('rent_debt_collection.block_vehicle_w_invoice_overdue', raise_if_not_found=False)
+        if not cron:
+            return
+        cron = cron.sudo()
+        exhausted = not cron.active and cron.numbercall == 0
+        if not cron.active and not exhausted:
+            _logger.info("Cron de bloqueio desativado manualmente: agenda mantida")
+            return
+
+        tz_name = self.env.user.tz or 'America/Sao_Paulo'
+        local_tz = pytz.timezone(tz_name)
+        now_local = datetime.datetime.now(pytz.utc).astimezone(local_tz)
+
+        ICP = self.env['ir.config_parameter'].sudo()
+        start_hour = float(ICP.get_param('fleet.block_start_hour', default=6.0))
+        end_hour = float(ICP.get_param('fleet.block_end_hour', default=18.0))
+        if end_hour <= start_hour:
+            _logger.warning("Janela de bloqueio inválida (%s-%s): agenda do cron mantida", start_hour, end_hour)
+            return
+
+        def _at(day, hour):
+            return local_tz.localize(datetime.datetime.combine(
+                day, datetime.time(int(hour), int(round((hour - int(hour)) * 60)) % 60)
+            ))
+
+        window_start = _at(now_local.date(), start_hour)
+        window_end = _at(now_local.date(), end_hour)
+        if now_local >= window_end:
+            window_start = _at(now_local.date() + timedelta(days=1), start_hour)
+            window_end = _at(now_local.date() + timedelta(days=1), end_hour)
+        first_call = max(window_start, now_local)
+
+        interval = datetime.timedelta(**{cron.interval_type: cron.interval_number}) \
+            if cron.interval_type in ('minutes', 'hours', 'days', 'weeks') else timedelta(hours=2)
+        numbercall = max(1, int(math.ceil((window_end - first_call).total_seconds() / interval.total_seconds())))
+
+        vals = {
+            'numbercall': numbercall,
+            'nextcall': fields.Datetime.to_string(first_call.astimezone(pytz.utc).replace(tzinfo=None)),
+        }
+        if exhausted:
+            # Desativado pelo próprio ir.cron ao esgotar numbercall
+            vals['active'] = True
+        cron.write(vals)
+        _logger.info("Cron de bloqueio agendado: %s execuções a partir de %s", numbercall, first_call)
+
+    @api.model
+    def _get_traccar_client(self):
+        """Cliente assíncrono da API do Traccar configurada nas configurações da frota."""
+        ICP = self.env['ir.config_parameter'].sudo()
+        return TraccarClient(
+            ICP.get_param('fleet.traccar_api_url'),
+            ICP.get_param('fleet.traccar_api_key'),
+            timeout=float(ICP.get_param('fleet.traccar_timeout', default=10.0)),
+        )
+
+    @api.model
+    def _send_engine_commands(self, vehicles, command_type):
+        """
+        Envia o comando de motor aos rastreadores. Veículos com Traccar Device ID usam o
+        cliente Traccar, em lote e sob o timeout configurado (com o circuit breaker aberto os
+        comandos falham imediatamente); os demais usam a API do próprio rastreador.
+        Retorna {vehicle_id: True | mensagem de erro}.
+        """
+        results = {}
+        targets = vehicles.filtered('traccar_device_id')
+        for vehicle in vehicles - targets:
+            results[vehicle.id] = vehicle._send_tracker_engine_command(command_type)
+        if not targets:
+            return results
+
+        commands = [(vehicle.traccar_device_id, command_type) for vehicle in targets]
+        try:
+            client = self._get_traccar_client()
+
+            async def _send():
+                async with client:
+                    return await client.send_commands(commands)
+
+            sent = run_sync(_send)
+        except TraccarError as e:
+            sent = dict.fromkeys(targets.mapped('traccar_device_id'), e)
+
+        for vehicle in targets:
+            outcome = sent.get(vehicle.traccar_device_id)
+            results[vehicle.id] = True if outcome is True else str(outcome)
+        return results
 
     def _block_vehicle_w_invoice_overdue(self):
         """
         Lógica individual de bloqueio. Verifica tolerância e executa o comando.
         """
         self.ensure_one()
+        evaluation = self._evaluate_vehicle_block()
+        if evaluation:
+            return self._execute_vehicle_block(*evaluation)
+
+    def _evaluate_vehicle_block(self):
+        """
+        Verifica se a fatura justifica o bloqueio. Retorna (dias de atraso, tolerância,
+        reincidente) quando o atraso supera a tolerância; caso contrário None.
+        """
+        self.ensure_one()
 
         # 1. Validações básicas (Guard Clauses)
         if not (self.type == 'out_invoice' and self.state == 'posted' and self.invoice_payment_state == 'not_paid'):
@@ -458,53 +908,95 @@ class AccountMove(models.Model):
 
         # 6. Execução do Bloqueio
         if days_overdue > tolerance_days:
-            self._execute_vehicle_block(days_overdue, tolerance_days, is_recidivist)
+            return days_overdue, tolerance_days, is_recidivist
+
+    def _get_vehicles_to_block(self):
+        """Veículos do motorista com rastreador cujo estado real (ou último comando) não é bloqueado."""
+        self.ensure_one()
+        Vehicle = self.env['fleet.vehicle']
+        return Vehicle.search([
+            ('driver_id', '=', self.partner_id.id),
+            ('tracker_device', '!=', False),
+        ] + Vehicle._get_engine_state_domain(STATE_UNBLOCKED))
 
     def _execute_vehicle_block(self, days_overdue, tolerance_days, is_recidivist):
         """
         Método auxiliar para separar a lógica de busca e comando do rastreador.
+        Retorna False se algum comando de bloqueio falhou.
         """
-        vehicles = self.env['fleet.vehicle'].search([('driver_id', '=', self.partner_id.id)])
-
+        vehicles = self._get_vehicles_to_block()
         if not vehicles:
-            _logger.warning(f"Move {self.id}: Nenhum veículo encontrado para o parceiro {self.partner_id.name}.")
+            _logger.info(f"Move {self.id}: Nenhum veículo a bloquear para o parceiro {self.partner_id.name}.")
             return
 
+        _logger.info(f"Sending BLOCK command to vehicles {vehicles.mapped('license_plate')}")
+        results = self._send_engine_commands(vehicles, ENGINE_STOP)
+        success = self._record_vehicle_block(vehicles, results, days_overdue, tolerance_days, is_recidivist)
+        if any(results.get(vehicle.id) is True for vehicle in vehicles):
+            self._send_block_notification()
+        return success
+
+    def _record_vehicle_block(self, vehicles, results, days_overdue, tolerance_days, is_recidivist):
+        """
+        Registra os bloqueios aceitos ({vehicle_id: True | erro} de _send_engine_commands).
+        Retorna False se algum comando de bloqueio falhou.
+        """
+        success = True
+
         for vehicle in vehicles:
-            # Otimização: Pula se não tiver rastreador ou já estiver bloqueado
-            if not vehicle.tracker_device or vehicle.tracker_device.engine_last_cmd == 'blocked':
+            outcome = results.get(vehicle.id)
+            if outcome is not True:
+                success = False
+                _logger.error(f"Erro ao bloquear veículo {vehicle.license_plate} (Fatura {self.id}): {outcome}")
                 continue
 
             try:
-                _logger.info(f"Sending BLOCK command to vehicle {vehicle.license_plate}")
-                response = vehicle.tracker_device.stop_engine()
-
-                if response:
-                    # Log no Veículo
-                    msg_vehicle = _(
-                        "Veículo bloqueado automaticamente por inadimplência.<br/>"
-                        "<b>Fatura:</b> %s<br/>"
-                        "<b>Dias de atraso:</b> %s<br/>"
-                        "<b>Reincidente:</b> %s"
-                    ) % (self.name, days_overdue, "Sim" if is_recidivist else "Não")
-                    vehicle.message_post(body=msg_vehicle)
-
-                    # Log na Fatura
-                    msg_move = _(
-                        "Comando de bloqueio enviado para o veículo %s.<br/>"
-                        "Atraso superior a %s dias de tolerância."
-                    ) % (vehicle.license_plate, tolerance_days)
-                    self.message_post(body=msg_move)
-
-                    # Envia Notificação de Bloqueio (WhatsApp / SMS / Email)
-                    self._send_whatsapp_notification(
-                        'rent_debt_collection.wa_template_aviso_bloqueio_efetuado',
-                        sms_fallback_xml_id='rent_debt_collection.sms_template_data_invoice_overdue_blocked'
-                    )
-                    self._send_email_notification('rent_debt_collection.email_template_aviso_bloqueio_efetuado')
-
+                # Estado otimista até a próxima sincronização com o Traccar
+                vehicle._record_engine_command(STATE_BLOCKED)
+
+                # Log no Veículo
+                msg_vehicle = _(
+                    "Veículo bloqueado automaticamente por inadimplência.<br/>"
+                    "<b>Fatura:</b> %s<br/>"
+                    "<b>Dias de atraso:</b> %s<br/>"
+                    "<b>Reincidente:</b> %s"
+                ) % (self.name, days_overdue, "Sim" if is_recidivist else "Não")
+                vehicle.message_post(body=msg_vehicle)
+
+                # Log na Fatura
+                msg_move = _(
+                    "Comando de bloqueio enviado para o veículo %s.<br/>"
+                    "Atraso superior a %s dias de tolerância."
+                ) % (vehicle.license_plate, tolerance_days)
+                self.message_post(body=msg_move)
             except Exception as e:
-                _logger.error(f"Erro ao bloquear veículo {vehicle.license_plate} (Fatura {self.id}): {e}")
+                success = False
+                _logger.error(f"Erro ao registrar bloqueio do veículo {vehicle.license_plate} (Fatura {self.id}): {e}")
+
+        return success
+
+    def _send_block_notification(self):
+        """
+        Envia a Notificação de Bloqueio (WhatsApp / SMS / Email) com todas as faturas vencidas
+        do motorista, qualquer que seja a fatura que enviou o comando: as demais faturas
+        não encontram veículos a bloquear e não gerariam aviso.
+        """
+        self._get_partner_overdue_moves()._send_consolidated_notification(
+            'rent_debt_collection.wa_template_aviso_bloqueio_efetuado',
+            sms_fallback_xml_id='rent_debt_collection.sms_template_data_invoice_overdue_blocked',
+            email_template_xml_id='rent_debt_collection.email_template_aviso_bloqueio_efetuado'
+        )
+
+    def _get_partner_overdue_moves(self):
+        """Faturas de cliente vencidas e em aberto do parceiro desta fatura, incluindo ela própria."""
+        self.ensure_one()
+        return self | self.search([
+            ('partner_id', '=', self.partner_id.id),
+            ('type', '=', 'out_invoice'),
+            ('state', '=', 'posted'),
+            ('invoice_payment_state', '=', 'not_paid'),
+            ('invoice_date_due', '<', fields.Date.context_today(self)),
+        ] + self._get_no_active_promise_domain())
 
     def _batch_unlock_vehicle_clean_record(self):
         """
@@ -512,27 +1004,40 @@ class AccountMove(models.Model):
         e desbloqueia se não houver mais pendências financeiras.
         """
         _logger.info("Starting batch vehicle unlock check...")
+        with self._read_replica_env() as reader:
+            reader._unlock_vehicle_clean_record()
+
+    @api.model
+    def _unlock_vehicle_clean_record(self):
+        """Avalia e desbloqueia os veículos; leituras de histórico usam a réplica aberta pela execução."""
 
         # 1. Busca veículos que estão atualmente bloqueados
-        blocked_vehicles = self.env['fleet.vehicle'].search([
+        # Estado real sincronizado ou do último comando; desconhecido recorre a engine_last_cmd
+        Vehicle = self.env['fleet.vehicle']
+        blocked_vehicles = Vehicle.search([
             ('tracker_device', '!=', False),
-            ('tracker_device.engine_last_cmd', '=', 'blocked')
-        ])
+        ] + Vehicle._get_engine_state_domain(STATE_BLOCKED))
+        if not blocked_vehicles:
+            _logger.info("Skipping unlock batch: No blocked vehicles.")
+            return
 
         _logger.info(f"Found {len(blocked_vehicles)} blocked vehicles to evaluate for unblock.")
 
+        # Veículos sem débitos impeditivos; os comandos são enviados em lote ao final da avaliação
+        to_unlock = Vehicle.browse()
         for vehicle in blocked_vehicles:
             driver = vehicle.driver_id
             if not driver:
                 continue
 
             # 2. Busca todas as faturas em aberto do motorista
-            overdue_invoices = self.env['account.move'].search([
+            # Faturas com promessa ativa não mantêm o bloqueio e são excluídas já na busca
+            overdue_invoices = self._search_read_only([
                 ('partner_id', '=', driver.id),
                 ('type', '=', 'out_invoice'),
                 ('state', '=', 'posted'),
                 ('invoice_payment_state', '=', 'not_paid'),
-            ])
+            ] + self._get_no_active_promise_domain())
 
             # 3. Força a verificação de pagamento no gateway para cada fatura em aberto
             for move in overdue_invoices:
@@ -555,8 +1060,8 @@ class AccountMove(models.Model):
 
             still_has_blocking_debt = False
             for move in overdue_invoices:
-                # Se a fatura foi paga ou tem promessa ativa, ela não mantém o bloqueio
-                if move.invoice_payment_state == 'paid' or move._active_payment_promise():
+                # Se a fatura foi paga, ela não mantém o bloqueio
+                if move.invoice_payment_state == 'paid':
                     continue
 
                 # Verifica a tolerância de dias úteis
@@ -579,28 +1084,52 @@ class AccountMove(models.Model):
                     still_has_blocking_debt = True
                     break
 
-            # 5. Se não houver mais débitos impeditivos, envia o comando de desbloqueio
             if not still_has_blocking_debt:
+                to_unlock |= vehicle
+
+        # 5. Envia os comandos de desbloqueio em lote e registra os que foram aceitos
+        results = {}
+        if to_unlock:
+            _logger.info(f"Unblocking vehicles {to_unlock.mapped('license_plate')}")
+            results = self._send_engine_commands(to_unlock, ENGINE_RESUME)
+
+        # Por motorista: registra os veículos liberados e envia um único aviso logo em seguida,
+        # mesmo com vários veículos liberados
+        for driver in to_unlock.mapped('driver_id'):
+            unlocked = False
+            for vehicle in to_unlock.filtered(lambda v: v.driver_id == driver):
+                outcome = results.get(vehicle.id)
+                if outcome is not True:
+                    _logger.error(f"Error unblocking vehicle {vehicle.license_plate}: {outcome}")
+                    continue
+
                 try:
-                    _logger.info(f"Unblocking vehicle {vehicle.license_plate} for driver {driver.name}")
-                    vehicle.tracker_device.resume_engine()
+                    vehicle._record_engine_command(STATE_UNBLOCKED)
 
                     vehicle.message_post(body=_("Veículo desbloqueado automaticamente: Pendências financeiras regularizadas."))
+                    self.env.cr.commit()
+                    unlocked = True
+                except Exception as e:
+                    self.env.cr.rollback()
+                    _logger.error(f"Error unblocking vehicle {vehicle.license_plate}: {e}")
 
-                    # Notificação de Desbloqueio
-                    # Busca a fatura mais recente para usar como contexto de envio
-                    last_invoice = self.env['account.move'].search([
-                        ('partner_id', '=', driver.id),
-                        ('type', '=', 'out_invoice')
-                    ], limit=1, order='invoice_date_due desc')
+            if not unlocked:
+                continue
 
-                    if last_invoice:
-                        last_invoice._send_whatsapp_notification(
-                            'rent_debt_collection.wa_template_aviso_desbloqueio_solicitado'
-                        )
-                        last_invoice._send_email_notification('rent_debt_collection.email_template_aviso_desbloqueio_solicitado')
+            # Notificação de Desbloqueio
+            # Busca a fatura mais recente para usar como contexto de envio
+            last_invoice = self.search([
+                ('partner_id', '=', driver.id),
+                ('type', '=', 'out_invoice')
+            ], limit=1, order='invoice_date_due desc')
 
+            if last_invoice:
+                try:
+                    last_invoice._send_consolidated_notification(
+                        'rent_debt_collection.wa_template_aviso_desbloqueio_solicitado',
+                        email_template_xml_id='rent_debt_collection.email_template_aviso_desbloqueio_solicitado'
+                    )
                     self.env.cr.commit()
                 except Exception as e:
                     self.env.cr.rollback()
-                    _logger.error(f"Error unblocking vehicle {vehicle.license_plate}: {e}")
+                    _logger.exception(f"Error sending unblock notice to {driver.name}: {e}")
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import logging
+from odoo import models, fields, api, _
+from ..tools.traccar_client import TraccarError, ENGINE_STOP, STATE_BLOCKED, STATE_UNBLOCKED, STATE_UNKNOWN, run_sync
+
+_logger = logging.getLogger(__name__)
+
+
+class FleetVehicle(models.Model):
+    _inherit = 'fleet.vehicle'
+
+    traccar_device_id = fields.Integer(
+        string='Traccar Device ID', index=True, copy=False,
+        help="ID do dispositivo no Traccar, informado e conferido manualmente. Quando preenchido, "
+             "os comandos de motor vão direto a este dispositivo pelo cliente Traccar; "
+             "vazio, usam a API do rastreador do veículo."
+    )
+    engine_actual_state = fields.Selection([
+        (STATE_BLOCKED, 'Bloqueado'),
+        (STATE_UNBLOCKED, 'Desbloqueado'),
+        (STATE_UNKNOWN, 'Desconhecido'),
+    ], string='Estado Real do Motor', default=STATE_UNKNOWN, index=True, copy=False, readonly=True,
+        help="Estado do motor reportado pelo rastreador na última sincronização com o Traccar."
+    )
+
+    @api.model
+    def _is_engine_state_fresh(self):
+        """Indica se a última sincronização em massa ainda está dentro da validade."""
+        return self.env['rent.debt.tracker.sync']._is_fresh()
+
+    @api.model
+    def _get_engine_state_domain(self, state):
+        """
+        Domínio dos veículos cujo estado efetivo do motor é ``state``.
+        Usa o último estado conhecido (sincronizado ou do último comando enviado por este
+        módulo); se desconhecido, recorre a engine_last_cmd do rastreador.
+        """
+        if state == STATE_BLOCKED:
+            last_cmd_leaf = ('tracker_device.engine_last_cmd', '=', 'blocked')
+        else:
+            last_cmd_leaf = ('tracker_device.engine_last_cmd', '!=', 'blocked')
+
+        return [
+            '|',
+                ('engine_actual_state', '=', state),
+                '&', ('engine_actual_state', '=', STATE_UNKNOWN), last_cmd_leaf
+        ]
+
+    def _record_engine_command(self, state):
+        """
+        Registra um comando de motor aceito: estado otimista até a próxima sincronização.
+        engine_last_cmd pertence ao módulo do rastreador e não é alterado aqui.
+        """
+        self.write({'engine_actual_state': state})
+
+    def _send_tracker_engine_command(self, command_type):
+        """
+        Envia o comando pela API do próprio rastreador (tracker_device), usada pelos
+        veículos sem Traccar Device ID confirmado. Retorna True ou a mensagem de erro.
+        """
+        self.ensure_one()
+        if not self.tracker_device:
+            return _("Veículo sem rastreador.")
+        try:
+            if command_type == ENGINE_STOP:
+                if not self.tracker_device.stop_engine():
+                    return _("O rastreador não confirmou o comando de bloqueio.")
+            else:
+                self.tracker_device.resume_engine()
+        except Exception as e:
+            return str(e)
+        return True
+
+    @api.model
+    def _cron_sync_tracker_states(self):
+        """
+        Job cron: busca em massa o estado real dos rastreadores no Traccar
+        e atualiza engine_actual_state apenas nos veículos cujo estado mudou.
+        """
+        vehicles = self.search([('traccar_device_id', '!=', False)])
+
+        try:
+            client = self.env['account.move']._get_traccar_client()
+
+            async def _fetch():
+                async with client:
+                    return await client.fetch_device_states()
+
+            states = run_sync(_fetch)
+        except TraccarError as e:
+            _logger.warning("Sincronização de rastreadores ignorada: %s", e)
+            return
+
+        to_write = {}
+        for vehicle in vehicles:
+            state = states.get(vehicle.traccar_device_id, STATE_UNKNOWN)
+            if vehicle.engine_actual_state != state:
+                to_write.setdefault(state, []).append(vehicle.id)
+
+        # Uma escrita por estado; veículos inalterados não têm write_date alterado
+        for state, vehicle_ids in to_write.items():
+            self.browse(vehicle_ids).write({'engine_actual_state': state})
+
+        self.env['rent.debt.tracker.sync']._mark_synced(len(states))
+        _logger.info(
+            "Rastreadores sincronizados: %s dispositivos, %s veículos alterados",
+            len(states), sum(len(ids) for ids in to_write.values())
+        )
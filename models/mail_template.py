@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import functools
+import logging
+from odoo import models, api, tools, _
+from odoo.exceptions import UserError
+from odoo.addons.mail.models import mail_template as mail_template_module
+
+_logger = logging.getLogger(__name__)
+
+# Chave de contexto que ativa a renderização com templates compilados em cache.
+# Definida apenas pelos envios deste módulo (redundância de e-mail e fallback de SMS).
+COMPILED_RENDER_KEY = 'rent_debt_compiled_render'
+
+# Ambiente Jinja próprio (overlay do ambiente do mail, com a mesma configuração),
+# para que o cache não altere a renderização de outros módulos ou bancos.
+_jinja_env = mail_template_module.mako_template_env.overlay()
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_template(template_txt):
+    """Compila o template uma única vez por texto fonte; templates compilados são imutáveis."""
+    return _jinja_env.from_string(template_txt)
+
+
+class MailTemplate(models.Model):
+    _inherit = 'mail.template'
+
+    @api.model
+    def _render_template_variables(self):
+        """Variáveis de renderização equivalentes às de mail.template._render_template."""
+        variables = {
+            'format_amount': lambda amount, currency, lang_code=False: tools.format_amount(self.env, amount, currency, lang_code),
+            'format_duration': lambda value: tools.format_duration(value),
+            'user': self.env.user,
+            'ctx': self._context,
+        }
+        if hasattr(mail_template_module, 'format_date'):
+            variables['format_date'] = lambda date, date_format=False, lang_code=False: \
+                mail_template_module.format_date(self.env, date, date_format, lang_code)
+        if hasattr(mail_template_module, 'format_datetime'):
+            variables['format_datetime'] = lambda dt, tz=False, dt_format=False, lang_code=False: \
+                mail_template_module.format_datetime(self.env, dt, tz, dt_format, lang_code)
+        return variables
+
+    @api.model
+    def _render_template(self, template_txt, model, res_ids, post_process=False):
+        """
+        Nos envios deste módulo, reaproveita o template compilado em vez de recompilá-lo
+        a cada fatura. Usado também pelos templates de SMS, que delegam para este método.
+        """
+        if not self.env.context.get(COMPILED_RENDER_KEY) or self.env.context.get('safe') or not template_txt:
+            return super(MailTemplate, self)._render_template(template_txt, model, res_ids, post_process=post_process)
+
+        try:
+            template = _compile_template(tools.ustr(template_txt))
+        except Exception:
+            # O método padrão registra o erro de compilação
+            return super(MailTemplate, self)._render_template(template_txt, model, res_ids, post_process=post_process)
+
+        multi_mode = not isinstance(res_ids, int)
+        ids = list(res_ids) if multi_mode else [res_ids]
+
+        records = {rec.id: rec for rec in self.env[model].browse([res_id for res_id in ids if res_id])}
+        variables = self._render_template_variables()
+        results = {}
+        for res_id in ids:
+            variables['object'] = records.get(res_id)
+            try:
+                render_result = template.render(variables)
+            except Exception as e:
+                _logger.info("Failed to render template %r using values %r" % (template, variables), exc_info=True)
+                raise UserError(_("Failed to render template %r using values %r") % (template, variables) +
+                                "\n\n%s: %s" % (type(e).__name__, str(e)))
+            if render_result == u"False":
+                render_result = u""
+            results[res_id] = self.render_post_process(render_result) if post_process else render_result
+
+        return results if multi_mode else results[ids[0]]
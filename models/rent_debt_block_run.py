@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from odoo import models, fields, api
+
+
+class RentDebtBlockRun(models.Model):
+    """
+    Estado da última execução completa do cron de bloqueio (watermark e regras).
+    Mantido em tabela própria pelo mesmo motivo de rent.debt.tracker.sync:
+    ir.config_parameter limparia o ormcache de todos os workers a cada execução.
+    """
+    _name = 'rent.debt.block.run'
+    _description = 'Vehicle Block Run State'
+
+    run_state = fields.Char(string='Estado da Execução', readonly=True)
+    run_at = fields.Datetime(string='Última Execução Completa', readonly=True)
+
+    @api.model
+    def _get_last_state(self):
+        return self.sudo().search([], limit=1).run_state
+
+    @api.model
+    def _set_last_state(self, run_state):
+        record = self.sudo().search([], limit=1)
+        vals = {'run_state': run_state, 'run_at': fields.Datetime.now()}
+        if record:
+            record.write(vals)
+        else:
+            self.sudo().create(vals)
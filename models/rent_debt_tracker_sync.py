@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from datetime import timedelta
+from odoo import models, fields, api
+
+
+class RentDebtTrackerSync(models.Model):
+    """
+    Estado da última sincronização em massa dos rastreadores.
+    Mantido em tabela própria: gravar em ir.config_parameter a cada execução
+    limparia o ormcache de todo o registry em todos os workers.
+    """
+    _name = 'rent.debt.tracker.sync'
+    _description = 'Tracker State Sync'
+
+    synced_at = fields.Datetime(string='Última Sincronização', readonly=True)
+    device_count = fields.Integer(string='Dispositivos', readonly=True)
+
+    @api.model
+    def _get_state(self):
+        state = self.sudo().search([], limit=1)
+        if not state:
+            state = self.sudo().create({})
+        return state
+
+    @api.model
+    def _mark_synced(self, device_count):
+        self._get_state().write({
+            'synced_at': fields.Datetime.now(),
+            'device_count': device_count,
+        })
+
+    @api.model
+    def _is_fresh(self):
+        """Indica se a última sincronização ainda está dentro da validade configurada."""
+        synced_at = self.sudo().search([], limit=1).synced_at
+        if not synced_at:
+            return False
+        ICP = self.env['ir.config_parameter'].sudo()
+        max_age = int(ICP.get_param('fleet.tracker_state_max_age_minutes', default=60))
+        return synced_at >= fields.Datetime.now() - timedelta(minutes=max_age)
@@ -17,7 +17,34 @@ class ResConfigSettings(models.TransientModel):
         config_parameter='fleet.traccar_api_key',
         help='Chave de acesso à API do Traccar'
     )
-    
+
+    traccar_timeout = fields.Float(
+        string='Traccar Timeout (s)',
+        config_parameter='fleet.traccar_timeout',
+        default=10.0,
+        help='Tempo máximo de espera por requisição à API do Traccar'
+    )
+
+    fleet_tracker_state_max_age_minutes = fields.Integer(
+        string='Validade do Estado dos Rastreadores (Minutos)',
+        config_parameter='fleet.tracker_state_max_age_minutes',
+        default=60,
+        help='Após este período sem sincronização, os crons voltam a usar o último comando enviado.'
+    )
+
+    fleet_read_replica_dsn = fields.Char(
+        string='Réplica de Leitura (DSN)',
+        config_parameter='fleet.read_replica_dsn',
+        help='URI PostgreSQL (postgresql://...) de uma réplica somente leitura para as consultas dos crons. Vazio desativa.'
+    )
+
+    fleet_read_replica_max_lag = fields.Integer(
+        string='Atraso Máximo da Réplica (s)',
+        config_parameter='fleet.read_replica_max_lag',
+        default=30,
+        help='Se a réplica estiver mais atrasada que este limite, as leituras voltam para o banco principal.'
+    )
+
     fleet_block_start_hour = fields.Float(
         string='Inicio do Bloqueio (Hora)',
         config_parameter='fleet.block_start_hour',
@@ -52,3 +79,15 @@ class ResConfigSettings(models.TransientModel):
         default=2,
         help='Dias de carência após o vencimento antes do bloqueio para bons pagadores.'
     )
+
+    fleet_payment_promise_hours = fields.Float(
+        string='Duração da Promessa de Pagamento (Horas)',
+        config_parameter='fleet.payment_promise_hours',
+        default=24.0,
+        help='Período durante o qual uma promessa de pagamento suspende avisos e bloqueios.'
+    )
+
+    def set_values(self):
+        super(ResConfigSettings, self).set_values()
+        # Realinha o cron de bloqueio à janela de horário configurada
+        self.env['account.move']._schedule_block_cron()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+from aiohttp.test_utils import TestServer
+
+from odoo.tests.common import BaseCase, tagged
+
+from ..tools.traccar_client import (
+    CircuitBreaker, CircuitOpenError, TraccarClient, TraccarError, ENGINE_STOP, STATE_BLOCKED, run_sync,
+)
+from ..tools.traccar_stub import FakeTraccar
+
+
+@tagged('post_install', '-at_install')
+class TestTraccarClient(BaseCase):
+
+    def setUp(self):
+        super(TestTraccarClient, self).setUp()
+        self.now = 0.0
+        self.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=lambda: self.now)
+        self.fake = FakeTraccar(devices=3)
+
+    def _call(self, method, *args, timeout=5.0):
+        """Sobe o servidor falso e executa ``method`` do cliente contra ele."""
+        async def _run():
+            server = TestServer(self.fake.make_app())
+            await server.start_server()
+            try:
+                client = TraccarClient(str(server.make_url('/')), timeout=timeout, breaker=self.breaker)
+                async with client:
+                    return await getattr(client, method)(*args)
+            finally:
+                await server.close()
+
+        return run_sync(_run)
+
+    def test_circuit_breaker_cycle(self):
+        # Servidor falhando: o circuito abre após failure_threshold erros
+        self.fake.error_rate = 1.0
+        for _i in range(2):
+            with self.assertRaises(TraccarError):
+                self._call('stop_engine', 1)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+        # Aberto: nenhuma requisição chega ao servidor
+        self.fake.error_rate = 0.0
+        with self.assertRaises(CircuitOpenError):
+            self._call('stop_engine', 1)
+        self.assertFalse(self.fake.commands)
+
+        # Após reset_timeout, uma chamada de teste é permitida e fecha o circuito
+        self.now += 31
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self._call('stop_engine', 1)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(self.fake.commands, [(1, ENGINE_STOP)])
+        self.assertEqual(self._call('fetch_device_states')[1], STATE_BLOCKED)
+
+    def test_timeout_counts_as_failure(self):
+        self.fake.latency = 0.5
+        for _i in range(2):
+            with self.assertRaises(TraccarError):
+                self._call('stop_engine', 1, timeout=0.1)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+    def test_invalid_json_keeps_other_results(self):
+        self.fake.html_devices = {2}
+        results = self._call('send_commands', [(1, ENGINE_STOP), (2, ENGINE_STOP), (3, ENGINE_STOP)])
+        self.assertIs(results[1], True)
+        self.assertIsInstance(results[2], TraccarError)
+        self.assertIs(results[3], True)
+        self.assertEqual(sorted(self.fake.commands), [(1, ENGINE_STOP), (3, ENGINE_STOP)])
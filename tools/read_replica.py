@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+"""Conexão somente leitura a uma réplica PostgreSQL para as consultas pesadas dos crons."""
+import logging
+import time
+
+from odoo import sql_db
+
+_logger = logging.getLogger(__name__)
+
+# Atraso de replicação em segundos; 0 se o banco não é standby (ex.: segundo banco local
+# usado em testes). Em um standby com todo o WAL recebido já aplicado, o atraso é o tempo
+# desde a última mensagem do primário: com o receptor desconectado o LSN recebido fica
+# congelado e a igualdade dos LSNs não indica réplica em dia. Sem receptor em streaming,
+# ou sem permissão para ler pg_stat_wal_receiver (requer pg_read_all_stats), retorna NULL
+# e a réplica é recusada.
+REPLICATION_LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN receiver.status IS DISTINCT FROM 'streaming' THEN NULL
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+            THEN EXTRACT(EPOCH FROM now() - receiver.last_msg_receipt_time)
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+    FROM (SELECT 1) AS one
+    LEFT JOIN pg_stat_wal_receiver receiver ON true
+"""
+
+
+class ReadReplica(object):
+    """
+    Cursor em autocommit sobre a réplica: cada consulta usa seu próprio snapshot,
+    sem transações longas que conflitem com a replicação.
+
+    O atraso é verificado na abertura e novamente a cada ``check_every`` consultas
+    ou ``check_interval`` segundos. Se a réplica ficar inacessível ou mais atrasada
+    que ``max_lag`` segundos, ela é fechada e ``is_available()`` passa a retornar
+    False; a partir daí as leituras devem ir para o primário.
+    """
+
+    def __init__(self, dsn, max_lag=30.0, check_every=200, check_interval=60.0, clock=time.monotonic):
+        self.dsn = dsn
+        self.max_lag = max_lag
+        self.check_every = check_every
+        self.check_interval = check_interval
+        self._clock = clock
+        self._cr = None
+        self._queries = 0
+        self._checked_at = None
+
+    def open(self):
+        try:
+            cr = sql_db.db_connect(self.dsn, allow_uri=True).cursor()
+        except Exception as e:
+            _logger.warning("Read replica unavailable, using primary: %s", e)
+            return False
+
+        cr.autocommit(True)
+        try:
+            cr.execute("SET default_transaction_read_only = on")
+        except Exception as e:
+            cr.close()
+            _logger.warning("Read replica check failed, using primary: %s", e)
+            return False
+
+        self._cr = cr
+        return self._check_lag()
+
+    def close(self):
+        if self._cr is not None:
+            self._cr.close()
+            self._cr = None
+
+    def _check_lag(self):
+        try:
+            self._cr.execute(REPLICATION_LAG_QUERY)
+            lag = self._cr.fetchone()[0]
+        except Exception as e:
+            self.close()
+            _logger.warning("Read replica check failed, using primary: %s", e)
+            return False
+
+        if lag is None:
+            self.close()
+            _logger.warning("Read replica not streaming from the primary (or lag unreadable), using primary")
+            return False
+        lag = float(lag)
+        if lag > self.max_lag:
+            self.close()
+            _logger.warning("Read replica lagging %.1fs (max %.1fs), using primary", lag, self.max_lag)
+            return False
+
+        self._queries = 0
+        self._checked_at = self._clock()
+        return True
+
+    def is_available(self):
+        """Indica se a réplica pode atender a próxima leitura, reverificando o atraso quando devido."""
+        if self._cr is None:
+            return False
+        if self._queries >= self.check_every or self._clock() - self._checked_at >= self.check_interval:
+            return self._check_lag()
+        return True
+
+    def fetchall(self, query, params=None):
+        """Executa a consulta na réplica; em caso de falha fecha a conexão e repassa o erro."""
+        try:
+            self._cr.execute(query, params)
+            rows = self._cr.fetchall()
+        except Exception:
+            self.close()
+            raise
+        self._queries += 1
+        return rows
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+"""Cliente assíncrono da API REST do Traccar.
+
+Usa uma sessão HTTP com pool de conexões e um circuit breaker por servidor,
+para que um Traccar lento ou fora do ar não trave os crons de bloqueio.
+"""
+import asyncio
+import json
+import logging
+import time
+
+_logger = logging.getLogger(__name__)
+
+try:
+    import aiohttp
+except ImportError:
+    _logger.debug("Cannot `import aiohttp`.")
+    aiohttp = None
+
+# Comandos de motor do Traccar
+ENGINE_STOP = 'engineStop'
+ENGINE_RESUME = 'engineResume'
+
+# Estados reais de motor reportados pelo dispositivo
+STATE_BLOCKED = 'blocked'
+STATE_UNBLOCKED = 'unblocked'
+STATE_UNKNOWN = 'unknown'
+
+
+class TraccarError(Exception):
+    """Falha de comunicação ou resposta inválida da API do Traccar."""
+
+
+class CircuitOpenError(TraccarError):
+    """O circuit breaker está aberto: o servidor Traccar é considerado indisponível."""
+
+
+class CircuitBreaker(object):
+    """
+    Circuit breaker simples (closed -> open -> half-open).
+
+    Após ``failure_threshold`` falhas consecutivas o circuito abre e as chamadas
+    falham imediatamente por ``reset_timeout`` segundos. Depois disso uma única
+    chamada de teste é permitida; se tiver sucesso o circuito fecha novamente.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=60.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return self.CLOSED
+        if self._clock() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def before_call(self):
+        state = self.state
+        if state == self.OPEN:
+            raise CircuitOpenError("Traccar circuit open: skipping call")
+        if state == self.HALF_OPEN:
+            if self._probe_in_flight:
+                raise CircuitOpenError("Traccar circuit half-open: probe already in flight")
+            self._probe_in_flight = True
+
+    def record_success(self):
+        self._failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self._failures += 1
+        self._probe_in_flight = False
+        if self._opened_at is not None or self._failures >= self.failure_threshold:
+            if self._opened_at is None:
+                _logger.warning("Traccar circuit opened after %s consecutive failures", self._failures)
+            self._opened_at = self._clock()
+
+
+# Um breaker por servidor, compartilhado entre execuções dos crons no mesmo processo
+_breakers = {}
+
+
+def normalize_base_url(base_url):
+    """Retorna a URL base da API (terminada em /api), sem barra final."""
+    base_url = (base_url or '').rstrip('/')
+    if base_url and not base_url.endswith('/api'):
+        base_url += '/api'
+    return base_url
+
+
+def get_circuit_breaker(base_url, **kwargs):
+    base_url = normalize_base_url(base_url)
+    breaker = _breakers.get(base_url)
+    if breaker is None:
+        breaker = _breakers[base_url] = CircuitBreaker(**kwargs)
+    return breaker
+
+
+class TraccarClient(object):
+    """
+    Cliente assíncrono da API do Traccar.
+
+    Deve ser usado como context manager assíncrono, para que a mesma sessão
+    (e o mesmo pool de conexões) seja reaproveitada em todo o lote::
+
+        async with TraccarClient(url, token) as client:
+            states = await client.fetch_device_states()
+            await client.send_commands([(device_id, ENGINE_STOP)])
+    """
+
+    def __init__(self, base_url, api_key=None, timeout=10.0, pool_size=20,
+                 max_concurrency=10, breaker=None, slow_call_threshold=None):
+        if aiohttp is None:
+            raise TraccarError("aiohttp is required for the Traccar client")
+        self.base_url = normalize_base_url(base_url)
+        if not self.base_url:
+            raise TraccarError("Traccar API URL is not configured")
+        self.api_key = api_key
+        self.timeout = timeout
+        # Respostas mais lentas que este limite contam como falha para o breaker
+        self.slow_call_threshold = slow_call_threshold if slow_call_threshold is not None else timeout / 2.0
+        self.pool_size = pool_size
+        self.max_concurrency = max_concurrency
+        self.breaker = breaker or get_circuit_breaker(self.base_url)
+        self._session = None
+
+    async def __aenter__(self):
+        headers = {'Accept': 'application/json'}
+        if self.api_key:
+            headers['Authorization'] = 'Bearer %s' % self.api_key
+        self._session = aiohttp.ClientSession(
+            headers=headers,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            connector=aiohttp.TCPConnector(limit=self.pool_size),
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _request(self, method, path, **kwargs):
+        if self._session is None:
+            raise TraccarError("TraccarClient must be used as an async context manager")
+        self.breaker.before_call()
+        started = time.monotonic()
+        try:
+            async with self._session.request(method, self.base_url + path, **kwargs) as response:
+                status = response.status
+                body = await response.text()
+        except asyncio.CancelledError:
+            # Libera a chamada de teste do estado half-open
+            self.breaker.record_failure()
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.breaker.record_failure()
+            raise TraccarError("Traccar %s %s failed: %r" % (method, path, e))
+
+        if status >= 500:
+            self.breaker.record_failure()
+            raise TraccarError("Traccar %s %s returned %s" % (method, path, status))
+
+        elapsed = time.monotonic() - started
+        if elapsed > self.slow_call_threshold:
+            _logger.warning("Traccar %s %s slow response (%.1fs)", method, path, elapsed)
+            self.breaker.record_failure()
+        else:
+            # Erros 4xx indicam requisição inválida, não servidor degradado
+            self.breaker.record_success()
+        if status >= 400:
+            raise TraccarError("Traccar %s %s returned %s: %s" % (method, path, status, body))
+        if not body:
+            return None
+        try:
+            return json.loads(body)
+        except ValueError as e:
+            # Ex.: página HTML de um proxy na frente do Traccar
+            raise TraccarError("Traccar %s %s returned invalid JSON: %s" % (method, path, e))
+
+    async def fetch_devices(self, device_ids=None):
+        params = [('id', device_id) for device_id in device_ids or []]
+        return await self._request('GET', '/devices', params=params)
+
+    async def fetch_positions(self, position_ids=None):
+        params = [('id', position_id) for position_id in position_ids or []]
+        return await self._request('GET', '/positions', params=params)
+
+    async def fetch_device_states(self, device_ids=None, page_size=200):
+        """
+        Retorna {device_id: estado} com o estado real do motor de cada dispositivo.
+
+        Sem ``device_ids`` busca todos os dispositivos e as últimas posições de todos eles
+        em duas chamadas sem parâmetros (``/api/positions`` sem ids retorna a última posição
+        de cada dispositivo). Com ``device_ids`` as consultas são paginadas em lotes de
+        ``page_size``, mantendo a URL abaixo do limite do servidor.
+        O estado vem do atributo ``blocked`` da última posição reportada.
+        """
+        if not device_ids:
+            devices = await self.fetch_devices()
+            positions = self._index_positions(await self.fetch_positions())
+            return self._device_states(devices, positions)
+
+        device_ids = list(device_ids)
+        states = {}
+        for i in range(0, len(device_ids), page_size):
+            devices = await self.fetch_devices(device_ids[i:i + page_size])
+            try:
+                position_ids = [d['positionId'] for d in devices if d.get('positionId')]
+            except (AttributeError, TypeError) as e:
+                raise TraccarError("Traccar returned malformed devices: %r" % e)
+            positions = {}
+            if position_ids:
+                positions = self._index_positions(await self.fetch_positions(position_ids))
+            states.update(self._device_states(devices, positions))
+        return states
+
+    @staticmethod
+    def _index_positions(positions):
+        try:
+            return {p['id']: p for p in positions or []}
+        except (KeyError, TypeError) as e:
+            raise TraccarError("Traccar returned malformed positions: %r" % e)
+
+    @classmethod
+    def _device_states(cls, devices, positions):
+        states = {}
+        try:
+            for device in devices or []:
+                position = positions.get(device.get('positionId')) or {}
+                states[device['id']] = cls._engine_state(position.get('attributes') or {})
+        except (AttributeError, KeyError, TypeError) as e:
+            raise TraccarError("Traccar returned malformed devices: %r" % e)
+        return states
+
+    @staticmethod
+    def _engine_state(attributes):
+        blocked = attributes.get('blocked')
+        if blocked is None:
+            return STATE_UNKNOWN
+        return STATE_BLOCKED if blocked else STATE_UNBLOCKED
+
+    async def send_command(self, device_id, command_type):
+        return await self._request('POST', '/commands/send', json={
+            'deviceId': device_id,
+            'type': command_type,
+        })
+
+    async def stop_engine(self, device_id):
+        return await self.send_command(device_id, ENGINE_STOP)
+
+    async def resume_engine(self, device_id):
+        return await self.send_command(device_id, ENGINE_RESUME)
+
+    async def send_commands(self, commands):
+        """
+        Envia vários comandos concorrentemente, limitados por ``max_concurrency``.
+        Retorna {device_id: True | exceção}; com o circuito aberto os comandos
+        restantes falham imediatamente com CircuitOpenError. Um erro inesperado em
+        um comando não descarta o resultado dos comandos já enviados.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def _send(device_id, command_type):
+            async with semaphore:
+                await self.send_command(device_id, command_type)
+                return True
+
+        device_ids = [device_id for device_id, cmd in commands]
+        results = await asyncio.gather(
+            *[_send(device_id, cmd) for device_id, cmd in commands], return_exceptions=True
+        )
+        return dict(zip(device_ids, results))
+
+
+def run_sync(coro_factory):
+    """
+    Executa uma corrotina a partir do código síncrono do ORM, em um loop próprio.
+
+    ``coro_factory`` recebe nada e retorna a corrotina, para que a sessão HTTP
+    seja criada dentro do loop que a executa.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro_factory())
+    finally:
+        loop.close()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+"""Servidor Traccar falso, em memória, para testes e benchmarks locais.
+
+Implementa apenas as rotas usadas por ``traccar_client``: ``GET /api/devices``,
+``GET /api/positions`` e ``POST /api/commands/send``. Latência e taxa de erro
+são configuráveis para simular um servidor degradado.
+
+Uso::
+
+    python tools/traccar_stub.py --port 8082 --devices 500 --latency 0.2 --error-rate 0.1
+
+Depois configure ``fleet.traccar_api_url`` como ``http://localhost:8082``.
+"""
+import argparse
+import asyncio
+import random
+
+from aiohttp import web
+
+
+class FakeTraccar(object):
+
+    def __init__(self, devices=100, latency=0.0, error_rate=0.0, token=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.token = token
+        self.commands = []
+        # Dispositivos cujos comandos recebem uma página HTML com status 200 (ex.: proxy mal configurado)
+        self.html_devices = set()
+        self.devices = {}
+        self.positions = {}
+        for device_id in range(1, devices + 1):
+            self.devices[device_id] = {
+                'id': device_id,
+                'name': 'Device %s' % device_id,
+                'uniqueId': '%015d' % device_id,
+                'status': 'online',
+                'positionId': device_id,
+            }
+            self.positions[device_id] = {
+                'id': device_id,
+                'deviceId': device_id,
+                'attributes': {'blocked': False},
+            }
+
+    def make_app(self):
+        app = web.Application(middlewares=[self._middleware])
+        app.router.add_get('/api/devices', self.get_devices)
+        app.router.add_get('/api/positions', self.get_positions)
+        app.router.add_post('/api/commands/send', self.send_command)
+        return app
+
+    @web.middleware
+    async def _middleware(self, request, handler):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.token and request.headers.get('Authorization') != 'Bearer %s' % self.token:
+            return web.Response(status=401)
+        if self.error_rate and random.random() < self.error_rate:
+            return web.Response(status=503)
+        return await handler(request)
+
+    @staticmethod
+    def _ids(request):
+        return [int(value) for value in request.query.getall('id', [])]
+
+    async def get_devices(self, request):
+        ids = self._ids(request)
+        devices = [self.devices[i] for i in ids if i in self.devices] if ids else list(self.devices.values())
+        return web.json_response(devices)
+
+    async def get_positions(self, request):
+        ids = self._ids(request)
+        positions = [self.positions[i] for i in ids if i in self.positions] if ids else list(self.positions.values())
+        return web.json_response(positions)
+
+    async def send_command(self, request):
+        data = await request.json()
+        device_id = data.get('deviceId')
+        if device_id not in self.devices:
+            return web.Response(status=400, text='Unknown device')
+        if data.get('type') not in ('engineStop', 'engineResume'):
+            return web.Response(status=400, text='Unsupported command')
+        if device_id in self.html_devices:
+            return web.Response(text='<html><body>Gateway</body></html>', content_type='text/html')
+        self.commands.append((device_id, data['type']))
+        position = self.positions[self.devices[device_id]['positionId']]
+        position['attributes']['blocked'] = data['type'] == 'engineStop'
+        return web.json_response(data, status=202)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8082)
+    parser.add_argument('--devices', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.0, help='Latência por requisição (segundos)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fração de respostas 503')
+    parser.add_argument('--token', default=None, help='Token Bearer exigido (opcional)')
+    args = parser.parse_args()
+
+    fake = FakeTraccar(args.devices, args.latency, args.error_rate, args.token)
+    web.run_app(fake.make_app(), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()